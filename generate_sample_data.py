@@ -104,7 +104,7 @@ if __name__ == "__main__":
     
     # Save to Excel
     output_path = "data/sample_patient_data.xlsx"
-    df.to_excel(output_path, index=False, sheet_name="Patients")
+    df.to_excel(output_path, index=False, sheet_name="Patients", engine="xlsxwriter")
     
     print(f"✅ Sample data saved to {output_path}")
     print(f"📊 Total patients: {len(df)}")
@@ -10,16 +10,26 @@ Version: 1.0
 """
 
 import streamlit as st
+import streamlit.components.v1 as components
 import pandas as pd
 import numpy as np
 from datetime import datetime, timedelta
 import folium
-from streamlit_folium import st_folium
+from folium.plugins import FastMarkerCluster
 import plotly.express as px
 import plotly.graph_objects as go
-from dataclasses import dataclass
+import plotly.io as pio
+from collections import Counter, defaultdict
+from dataclasses import astuple, dataclass
+from itertools import cycle, permutations
+from operator import attrgetter
+from ortools.constraint_solver import pywrapcp
+from ortools.constraint_solver import routing_enums_pb2
 from typing import List, Dict, Tuple, Optional
+import html
 import io
+import re
+import sys
 import requests
 
 # ============================================================
@@ -36,7 +46,10 @@ st.set_page_config(
 # DATA STRUCTURES (Same as notebook)
 # ============================================================
 
-@dataclass
+# Slotted dataclasses need Python 3.10+; older versions get regular ones
+_SLOTS = {"slots": True} if sys.version_info >= (3, 10) else {}
+
+@dataclass(frozen=True, **_SLOTS)
 class Patient:
     """Patient information."""
     id: str
@@ -44,11 +57,12 @@ class Patient:
     address: str
     postal_code: str
     zone: str = ""
+    zone_id: int = 4  # Config.ZONE_ID["Central"]
     latitude: float = 0.0
     longitude: float = 0.0
     language: str = "English"
 
-@dataclass
+@dataclass(**_SLOTS)
 class Visit:
     """A scheduled visit."""
     id: str
@@ -62,7 +76,7 @@ class Visit:
     requires_continuity: bool = False
     continuity_group: str = ""
 
-@dataclass
+@dataclass(**_SLOTS)
 class Nurse:
     """Nurse information."""
     id: str
@@ -76,7 +90,7 @@ class Nurse:
         if self.preferred_zones is None:
             self.preferred_zones = ["North", "South", "East", "West", "Central"]
 
-@dataclass
+@dataclass(**_SLOTS)
 class ScheduledVisit:
     """Result of scheduling."""
     visit: Visit
@@ -111,6 +125,7 @@ class Config:
     HOSPITAL_RETURN_TIME = 30
     HOSPITAL_LAT = 1.3214
     HOSPITAL_LNG = 103.8456
+    NURSE_COLORS = ('blue', 'green', 'purple', 'orange', 'darkred')  # Folium marker colors
     
     ZONE_MAPPING = {
         "North": ["50", "51", "52", "53", "54", "55", "56", "57", "72", "73"],
@@ -121,6 +136,23 @@ class Config:
                    "21", "22", "23", "24", "25", "26", "27", "28", "29", "30",
                    "31", "32", "33", "34", "35", "36", "37"]
     }
+    
+    # Flattened ZONE_MAPPING for O(1) postal prefix lookups
+    PREFIX2ZONE = {prefix: zone for zone, prefixes in ZONE_MAPPING.items() for prefix in prefixes}
+    
+    # Approximate zone centres (lat, lng) for the route map
+    ZONE_COORDS = {
+        "North": (1.42, 103.82),
+        "South": (1.27, 103.82),
+        "East": (1.35, 103.94),
+        "West": (1.35, 103.70),
+        "Central": (1.35, 103.85)
+    }
+    
+    # Zone travel times in minutes, indexed as TRAVEL[ZONE_ID[from], ZONE_ID[to]]
+    ZONE_ID = {zone: i for i, zone in enumerate(ZONE_MAPPING)}
+    TRAVEL = np.full((len(ZONE_ID), len(ZONE_ID)), DEFAULT_TRAVEL_TIME, dtype=np.int16)
+    np.fill_diagonal(TRAVEL, SAME_ZONE_TRAVEL_TIME)
 
 
 # ============================================================
@@ -133,6 +165,17 @@ def minutes_to_time_string(minutes: int) -> str:
     mins = minutes % 60
     return f"{hours:02d}:{mins:02d}"
 
+class _TimeStrings(dict):
+    """Minutes -> "HH:MM"; times past the table are formatted on demand."""
+    
+    def __missing__(self, minutes: int) -> str:
+        return minutes_to_time_string(minutes)
+
+# "HH:MM" for every minute of the day, so display loops look up instead of
+# formatting. A task can name a late time ("Others 23:59"), pushing visits
+# past midnight, so lookups outside the day still work.
+TIME_STR = _TimeStrings((m, minutes_to_time_string(m)) for m in range(24 * 60 + 1))
+
 def time_string_to_minutes(time_str: str) -> int:
     """Convert time string to minutes from midnight."""
     time_str = time_str.strip().upper()
@@ -160,6 +203,10 @@ def time_string_to_minutes(time_str: str) -> int:
 # EXCEL PARSER
 # ============================================================
 
+_POSTAL_PAREN = re.compile(r'S\((\d{6})\)')
+_POSTAL_BARE = re.compile(r'\b(\d{6})\b')
+_SPECTIME = re.compile(r'(\d{1,2}):(\d{2})')
+
 class ExcelParser:
     """Parse Excel files into structured data."""
     
@@ -182,70 +229,127 @@ class ExcelParser:
         self.warnings = []
     
     def parse_dataframe(self, df: pd.DataFrame) -> Tuple[List[Patient], List[Visit]]:
-        """Parse DataFrame into patients and visits."""
+        """
+        Parse DataFrame into patients and visits.
+        
+        Cleaning runs once per column, postal/zone lookup and task
+        classification once per distinct value; the row loop only assembles
+        Patient and Visit objects.
+        """
         self.patients = []
         self.visits = []
         self.warnings = []
         
-        for idx, row in df.iterrows():
+        if "Name" in df:
+            names = self._text_column(df, "Name")
+        else:
+            names = pd.Series([f"Patient_{idx}" for idx in df.index], index=df.index)
+        addresses = self._text_column(df, "Location")
+        codes, unique_addresses = pd.factorize(addresses)
+        locations = self._resolve_addresses(unique_addresses).take(codes)
+        postal_codes, zones, zone_ids = locations["postal_code"], locations["zone"], locations["zone_id"]
+        languages = self._text_column(df, "Language")
+        languages = languages.mask(languages.str.lower().isin(["nan", "", "none"]), "English")
+        
+        tasks1 = self._classify_tasks(
+            self._text_column(df, "Home Visit task/time"), skip=["nan", "", "none"])
+        tasks2 = self._classify_tasks(
+            self._text_column(df, "Session 2 task/time"), skip=["nan", "", "none", "pm"])
+        
+        # One patient slot per row; method lookups bound once for the loop
+        patients = [None] * len(df)
+        visits = []
+        add_visits = visits.extend
+        parse_visits = self._parse_visits_for_patient
+        warn = self.warnings.append
+        
+        rows = zip(df.index, names, addresses, postal_codes, zones, zone_ids, languages,
+                   tasks1, tasks2)
+        for row, (idx, name, address, postal_code, zone, zone_id, language,
+                  task1, task2) in enumerate(rows):
             try:
-                patient = self._parse_patient_row(row, idx)
-                self.patients.append(patient)
-                visits = self._parse_visits_for_patient(patient, row, idx)
-                self.visits.extend(visits)
+                patient = patients[row] = Patient(
+                    id=f"P{idx:03d}",
+                    name=name,
+                    address=address,
+                    postal_code=postal_code,
+                    zone=zone,
+                    zone_id=zone_id,
+                    language=language
+                )
+                add_visits(parse_visits(patient, task1, task2, idx))
             except Exception as e:
-                self.warnings.append(f"Row {idx}: {str(e)}")
+                warn(f"Row {idx}: {str(e)}")
         
+        # Rows that failed before their Patient was built leave a None slot
+        self.patients = [p for p in patients if p is not None] if self.warnings else patients
+        self.visits = visits
         return self.patients, self.visits
     
-    def _parse_patient_row(self, row: pd.Series, idx: int) -> Patient:
-        """Extract patient from row."""
-        name = str(row.get("Name", f"Patient_{idx}")).strip()
-        address = str(row.get("Location", "")).strip()
-        postal_code = self._extract_postal_code(address)
-        zone = self._determine_zone(postal_code)
-        language = str(row.get("Language", "English")).strip()
-        if language.lower() in ["nan", "", "none"]:
-            language = "English"
-        
-        return Patient(
-            id=f"P{idx:03d}",
-            name=name,
-            address=address,
-            postal_code=postal_code,
-            zone=zone,
-            language=language
-        )
+    @staticmethod
+    def _text_column(df: pd.DataFrame, column: str) -> pd.Series:
+        """Get a column as stripped strings (blank if the column is missing)."""
+        if column not in df:
+            return pd.Series("", index=df.index, dtype=object)
+        return df[column].fillna("").astype(str).str.strip()
+    
+    def _resolve_addresses(self, addresses: pd.Index) -> pd.DataFrame:
+        """Postal code, zone and zone id for each (distinct) address."""
+        postal_codes = [self._extract_postal_code(address) for address in addresses]
+        zones = [self._determine_zone(postal_code) for postal_code in postal_codes]
+        return pd.DataFrame({
+            "postal_code": postal_codes,
+            "zone": zones,
+            "zone_id": [Config.ZONE_ID[zone] for zone in zones],
+        })
+    
+    def _classify_tasks(self, tasks: pd.Series, skip: List[str]) -> List[Optional[Tuple]]:
+        """
+        Classify a column of task strings.
+        
+        Returns one (task, proc_info, priority, specific_time) tuple per row,
+        or None where the cell holds no task. specific_time is 0 when the
+        task has no fixed time. Each distinct task is classified only once.
+        """
+        codes, unique_tasks = pd.factorize(tasks)
+        classified = []
+        for task in unique_tasks:
+            lowered = task.lower()
+            if lowered in skip:
+                classified.append(None)
+                continue
+            classified.append((
+                task,
+                self._identify_procedure(task),
+                1 if "priority" in lowered else 3,
+                self._extract_specific_time(task) or 0,
+            ))
+        return [classified[code] for code in codes.tolist()]
     
     def _extract_postal_code(self, address: str) -> str:
         """Extract postal code from address."""
-        import re
-        match = re.search(r'S\((\d{6})\)', address)
+        match = _POSTAL_PAREN.search(address)
         if match:
             return match.group(1)
-        match = re.search(r'\b(\d{6})\b', address)
+        match = _POSTAL_BARE.search(address)
         if match:
             return match.group(1)
         return "000000"
     
     def _determine_zone(self, postal_code: str) -> str:
         """Determine zone from postal code."""
-        prefix = postal_code[:2]
-        for zone, prefixes in Config.ZONE_MAPPING.items():
-            if prefix in prefixes:
-                return zone
-        return "Central"
-    
-    def _parse_visits_for_patient(self, patient: Patient, row: pd.Series, idx: int) -> List[Visit]:
-        """Create visits for a patient."""
+        return Config.PREFIX2ZONE.get(postal_code[:2], "Central")
+    
+    def _parse_visits_for_patient(self, patient: Patient, task1: Optional[Tuple],
+                                  task2: Optional[Tuple], idx: int) -> List[Visit]:
+        """Create visits for a patient from its classified tasks."""
         visits = []
         
-        task1 = str(row.get("Home Visit task/time", "")).strip()
-        if task1 and task1.lower() not in ["nan", "", "none"]:
+        if task1:
             visit1 = self._create_visit(patient, task1, "AM", idx, 1)
             visits.append(visit1)
             
-            proc_info = self._identify_procedure(task1)
+            proc_info = task1[1]
             if proc_info.get("needs_pair", False):
                 visit2 = self._create_visit(patient, task1, "PM", idx, 2)
                 visit2.requires_continuity = True
@@ -254,25 +358,19 @@ class ExcelParser:
                 visit1.continuity_group = f"CG{idx:03d}"
                 visits.append(visit2)
         
-        task2 = str(row.get("Session 2 task/time", "")).strip()
-        if task2 and task2.lower() not in ["nan", "", "none", "pm"]:
+        if task2:
             if not any(v.session == "PM" for v in visits):
                 visit2 = self._create_visit(patient, task2, "PM", idx, 2)
                 visits.append(visit2)
         
         return visits
     
-    def _create_visit(self, patient: Patient, task: str, session: str, 
+    def _create_visit(self, patient: Patient, task_info: Tuple, session: str, 
                       patient_idx: int, visit_num: int) -> Visit:
         """Create a single visit."""
-        proc_info = self._identify_procedure(task)
+        task, proc_info, priority, specific_time = task_info
         earliest, latest = self._calculate_time_window(proc_info, task, session)
         
-        priority = 3
-        if "priority" in task.lower():
-            priority = 1
-        
-        specific_time = self._extract_specific_time(task)
         if specific_time:
             earliest = specific_time
             latest = specific_time + 30
@@ -294,7 +392,7 @@ class ExcelParser:
         for pattern, info in self.PROCEDURE_TYPES.items():
             if pattern in task_lower:
                 return info
-        return {"type": "OTHER", "duration": 30, "needs_pair": False}
+        return self.PROCEDURE_TYPES["others"]
     
     def _calculate_time_window(self, proc_info: Dict, task: str, session: str) -> Tuple[int, int]:
         """Calculate time window for visit."""
@@ -320,8 +418,7 @@ class ExcelParser:
     
     def _extract_specific_time(self, task: str) -> Optional[int]:
         """Extract specific time from task."""
-        import re
-        match = re.search(r'(\d{1,2}):(\d{2})', task)
+        match = _SPECTIME.search(task)
         if match:
             hours = int(match.group(1))
             minutes = int(match.group(2))
@@ -337,143 +434,726 @@ class ExcelParser:
 
 class SimpleScheduler:
     """
-    Simplified scheduler using greedy algorithm.
-    For full OR-Tools version, see the notebook.
+    Simplified scheduler using a cluster-first / route-second heuristic.
+    For larger rosters, VRPScheduler refines its result with OR-Tools.
     
     Fixes:
     - Continuity: Same nurse must handle related visits (e.g., 8-hr IV AM + PM)
     - Start time: All nurses start at 8:30 AM, not delayed by priority patients
-    - Scheduling: Visits sorted by earliest_time to fill slots chronologically
+    - Scheduling: Visits are clustered by (session, zone) so each nurse stays
+      in as few zones as possible, then each route is ordered for least travel
+    
+    Visit fields are held as parallel NumPy arrays (one entry per visit);
+    solve() works on visit indices and only builds ScheduledVisit objects
+    once every route is fixed.
     """
     
+    SESSIONS = ("AM", "PM")
+    MAX_EXACT_ROUTE = 6  # Longest route whose visit orders are all tried
+    
     def __init__(self, nurses: List[Nurse], visits: List[Visit]):
         self.nurses = nurses
         self.visits = visits
         self.scheduled_visits = []
         self.unassigned_visits = []
+        self._cg_to_nurse: Dict[str, str] = {}  # continuity_group -> nurse_id
+        
+        n = len(visits)
+        self.earliest = np.fromiter((v.earliest_time for v in visits), dtype=np.int16, count=n)
+        self.latest = np.fromiter((v.latest_time for v in visits), dtype=np.int16, count=n)
+        self.duration = np.fromiter((v.duration_minutes for v in visits), dtype=np.int16, count=n)
+        self.zone_id = np.fromiter((v.patient.zone_id for v in visits), dtype=np.int8, count=n)
+        self.session_id = np.fromiter((self.SESSIONS.index(v.session) for v in visits),
+                                      dtype=np.int8, count=n)
+        self.is_blood = np.fromiter((v.procedure == "BLOOD" for v in visits), dtype=bool, count=n)
     
     def solve(self) -> bool:
         """
-        Greedy scheduling with proper continuity handling.
+        Cluster-first / route-second scheduling.
         
         Algorithm:
-        1. First, identify continuity groups (e.g., 8-hr IV patients)
-        2. Sort visits: by earliest_time (to fill slots chronologically)
-        3. For continuity visits, pre-assign to same nurse
-        4. Fill slots maintaining 8:30 start
+        1. Place each continuity group (e.g., 8-hr IV patients) whole on one
+           nurse, so that nurse keeps room in every session of the group
+        2. Bucket the remaining visits into (session, zone) clusters
+        3. Walk clusters AM before PM, tightest deadline first; each visit goes
+           to the nurse already working that zone, else the least loaded one
+        4. A nurse only takes a visit if every time window on their session
+           route still holds, with the first visit starting at 8:30
+        5. Re-order each session route for the least travel
         """
-        
-        # Track nurse assignments by session
-        nurse_visits = {n.id: {"AM": [], "PM": []} for n in self.nurses}
-        
-        # Track which nurse is assigned to each continuity group
-        continuity_assignments = {}  # continuity_group -> nurse_id
+        self.scheduled_visits = []
+        self.unassigned_visits = []
+        self._cg_to_nurse = {}
         
         # Sort visits by earliest_time first, then by window tightness
         # This ensures we fill 8:30am slots before 10:00am slots
-        def sort_key(v):
-            # Blood draws get slight priority within their time slot
-            blood_priority = 0 if v.procedure == "BLOOD" else 1
-            return (v.earliest_time, blood_priority, v.latest_time - v.earliest_time)
-        
-        sorted_visits = sorted(self.visits, key=sort_key)
-        
-        # First pass: Pre-assign continuity groups to ensure same nurse
-        for visit in sorted_visits:
-            if visit.continuity_group and visit.continuity_group not in continuity_assignments:
-                # Find a nurse who can handle both AM and PM visits of this group
-                for nurse in self.nurses:
-                    # This nurse is available for continuity
-                    continuity_assignments[visit.continuity_group] = nurse.id
+        # (blood draws get slight priority within their time slot)
+        order = np.lexsort((self.latest - self.earliest, ~self.is_blood, self.earliest))
+        rank = np.empty_like(order)
+        rank[order] = np.arange(len(order))
+        
+        # Visits that miss their window even as a nurse's first stop
+        fits_alone = np.maximum(self.earliest, Config.WORK_START) <= self.latest
+        
+        # The route loops below touch one visit at a time, where plain lists
+        # index faster than NumPy arrays
+        order, rank, fits_alone = order.tolist(), rank.tolist(), fits_alone.tolist()
+        columns = (self.earliest.tolist(), self.latest.tolist(),
+                   self.duration.tolist(), self.zone_id.tolist())
+        latest, zone_id = columns[1], columns[3]
+        session_id = self.session_id.tolist()
+        travel = Config.TRAVEL.tolist()
+        
+        # Each nurse's visit indices per session, kept in chronological order
+        routes = {(n.id, s): [] for n in self.nurses for s in range(len(self.SESSIONS))}
+        
+        def try_insert(nurse, group):
+            """Add visits to the nurse's routes if all time windows still hold."""
+            updated = {}
+            for i in group:
+                key = (nurse.id, session_id[i])
+                route = updated.get(key, routes[key])
+                max_count = nurse.max_visits_am if session_id[i] == 0 else nurse.max_visits_pm
+                if len(route) >= max_count:
+                    return False  # Nurse at capacity for this session
+                route = sorted(route + [i], key=rank.__getitem__)
+                if self._time_route(route, columns, travel) is None:
+                    return False
+                updated[key] = route
+            routes.update(updated)
+            return True
+        
+        def candidates(session, zone):
+            """Nurses already working this zone first, then the least loaded."""
+            return sorted(self.nurses, key=lambda n: (
+                -sum(zone_id[i] == zone for i in routes[(n.id, session)]),
+                len(routes[(n.id, session)])
+            ))
+        
+        groups = defaultdict(list)
+        for i in order:
+            if self.visits[i].continuity_group:
+                groups[self.visits[i].continuity_group].append(i)
+        
+        for group_id, group in groups.items():
+            for nurse in candidates(session_id[group[0]], zone_id[group[0]]):
+                if try_insert(nurse, group):
+                    self._cg_to_nurse[group_id] = nurse.id
                     break
         
-        # Second pass: Schedule all visits
-        for visit in sorted_visits:
-            assigned = False
-            
-            # Determine which nurse to try first
-            if visit.continuity_group and visit.continuity_group in continuity_assignments:
-                # Must use the pre-assigned nurse for continuity
-                required_nurse_id = continuity_assignments[visit.continuity_group]
-                nurses_to_try = [n for n in self.nurses if n.id == required_nurse_id]
-            else:
-                # Try all nurses, prefer nurse with fewer visits in this session
-                session = visit.session
-                nurses_to_try = sorted(
-                    self.nurses, 
-                    key=lambda n: len(nurse_visits[n.id][session])
-                )
-            
-            for nurse in nurses_to_try:
-                session = visit.session
-                current_count = len(nurse_visits[nurse.id][session])
-                max_count = nurse.max_visits_am if session == "AM" else nurse.max_visits_pm
-                
-                if current_count >= max_count:
-                    continue  # Nurse at capacity for this session
+        # Groups no nurse could take whole fall through and are pinned to
+        # whichever nurse takes their first visit
+        clusters = defaultdict(list)
+        for i in order:
+            if self.visits[i].continuity_group not in self._cg_to_nurse:
+                clusters[(session_id[i], zone_id[i])].append(i)
+        
+        cluster_order = sorted(clusters, key=lambda k: (k[0], min(latest[i] for i in clusters[k])))
+        
+        for session, zone in cluster_order:
+            for i in clusters[(session, zone)]:
+                visit = self.visits[i]
+                pinned = self._cg_to_nurse.get(visit.continuity_group)
                 
-                # Calculate scheduled time
-                if nurse_visits[nurse.id][session]:
-                    # Not the first visit - schedule after previous
-                    last_sv = nurse_visits[nurse.id][session][-1]
-                    travel_time = (Config.SAME_ZONE_TRAVEL_TIME 
-                                   if last_sv.visit.patient.zone == visit.patient.zone 
-                                   else Config.DEFAULT_TRAVEL_TIME)
-                    scheduled_time = last_sv.scheduled_time + last_sv.visit.duration_minutes + travel_time
+                for nurse in (candidates(session, zone) if fits_alone[i] else []):
+                    if pinned and pinned != nurse.id:
+                        continue  # Continuity: must stay with the group's nurse
+                    if try_insert(nurse, [i]):
+                        if visit.continuity_group:
+                            self._cg_to_nurse[visit.continuity_group] = nurse.id
+                        break
                 else:
-                    # FIRST visit of the day - START AT 8:30 AM (WORK_START)
-                    travel_time = Config.HOSPITAL_RETURN_TIME
-                    scheduled_time = Config.WORK_START
-                
-                # Ensure scheduled time is within the visit's time window
-                scheduled_time = max(scheduled_time, visit.earliest_time)
-                
-                # Check if we can complete the visit within the time window
-                if scheduled_time <= visit.latest_time:
-                    sv = ScheduledVisit(
-                        visit=visit,
+                    self.unassigned_visits.append(visit)
+        
+        # Route second: order each nurse's session visits for least travel.
+        # Routes hold at most one session's visit cap, so this stays in-process
+        for nurse in self.nurses:
+            for session in range(len(self.SESSIONS)):
+                route = self._best_route(routes[(nurse.id, session)], columns, travel)
+                for sequence, (i, scheduled_time, travel_time) in enumerate(route):
+                    self.scheduled_visits.append(ScheduledVisit(
+                        visit=self.visits[i],
                         nurse=nurse,
                         scheduled_time=scheduled_time,
                         travel_time_from_previous=travel_time,
-                        sequence=current_count
-                    )
-                    self.scheduled_visits.append(sv)
-                    nurse_visits[nurse.id][session].append(sv)
-                    assigned = True
-                    break
-            
-            if not assigned:
-                self.unassigned_visits.append(visit)
+                        sequence=sequence
+                    ))
         
         return len(self.scheduled_visits) > 0
     
+    @staticmethod
+    def _time_route(route: List[int], columns: Tuple[List[int], ...],
+                    travel: List[List[int]]) -> Optional[List[Tuple[int, int]]]:
+        """
+        Schedule a session route (visit indices) in the given order.
+        
+        columns holds the (earliest, latest, duration, zone_id) values per
+        visit index. Returns (scheduled_time, travel_time) per visit, or None
+        if any visit would start after its latest time.
+        """
+        earliest, latest, duration, zone_id = columns
+        times = []
+        previous = None
+        for i in route:
+            if previous is None:
+                # FIRST visit of the session - START AT 8:30 AM (WORK_START)
+                travel_time = Config.HOSPITAL_RETURN_TIME
+                scheduled_time = Config.WORK_START
+            else:
+                travel_time = travel[zone_id[previous]][zone_id[i]]
+                scheduled_time = times[-1][0] + duration[previous] + travel_time
+            
+            # Ensure scheduled time is within the visit's time window
+            scheduled_time = max(scheduled_time, earliest[i])
+            if scheduled_time > latest[i]:
+                return None
+            
+            times.append((scheduled_time, travel_time))
+            previous = i
+        return times
+    
+    def _best_route(self, route: List[int], columns: Tuple[List[int], ...],
+                    travel: List[List[int]]) -> List[Tuple[int, int, int]]:
+        """
+        Pick the feasible visit order with the least travel.
+        
+        Short routes try every order; longer ones keep chronological order.
+        Returns (visit index, scheduled_time, travel_time) per visit.
+        """
+        best, best_cost = [], None
+        orders = permutations(route) if len(route) <= self.MAX_EXACT_ROUTE else [route]
+        for order in orders:
+            times = self._time_route(order, columns, travel)
+            if times is None:
+                continue
+            cost = sum(travel_time for _, travel_time in times)
+            if best_cost is None or cost < best_cost:
+                best = [(i, t, travel_time) for i, (t, travel_time) in zip(order, times)]
+                best_cost = cost
+        return best
+    
     def get_schedule_by_nurse(self) -> Dict[str, List[ScheduledVisit]]:
         """Get schedule organized by nurse."""
         schedule = {nurse.id: [] for nurse in self.nurses}
         for sv in self.scheduled_visits:
             schedule[sv.nurse.id].append(sv)
         # Sort by scheduled time
-        for nurse_id in schedule:
-            schedule[nurse_id].sort(key=lambda x: x.scheduled_time)
+        by_time = attrgetter('scheduled_time')
+        for nurse_visits in schedule.values():
+            nurse_visits.sort(key=by_time)
         return schedule
     
-    def calculate_metrics(self) -> Dict:
-        """Calculate metrics."""
+    def scheduled_arrays(self) -> Dict[str, np.ndarray]:
+        """
+        Scheduled visits as parallel arrays, in scheduled_visits order.
+        
+        nurse is the index into self.nurses, zone the Config.ZONE_ID, and
+        start / duration / travel are minutes.
+        """
+        svs = self.scheduled_visits
+        n = len(svs)
+        nurse_index = {nurse.id: i for i, nurse in enumerate(self.nurses)}
+        return {
+            'nurse': np.fromiter((nurse_index[sv.nurse.id] for sv in svs), dtype=np.intp, count=n),
+            'zone': np.fromiter((sv.visit.patient.zone_id for sv in svs), dtype=np.intp, count=n),
+            'start': np.fromiter((sv.scheduled_time for sv in svs), dtype=np.int32, count=n),
+            'duration': np.fromiter((sv.visit.duration_minutes for sv in svs), dtype=np.int32, count=n),
+            'travel': np.fromiter((sv.travel_time_from_previous for sv in svs), dtype=np.int32, count=n),
+        }
+    
+    def calculate_metrics(self, arrays: Optional[Dict[str, np.ndarray]] = None) -> Dict:
+        """Calculate metrics, reusing scheduled_arrays() output if given."""
+        if arrays is None:
+            arrays = self.scheduled_arrays()
+        # Counts are per nurse / zone index, so nurses with no visits still report 0
+        per_nurse = np.bincount(arrays['nurse'], minlength=len(self.nurses)).tolist()
+        per_zone = np.bincount(arrays['zone'], minlength=len(Config.ZONE_ID)).tolist()
         return {
             'total_visits': len(self.scheduled_visits),
-            'total_travel_time': sum(sv.travel_time_from_previous for sv in self.scheduled_visits),
-            'visits_per_nurse': {
-                n.name: len([sv for sv in self.scheduled_visits if sv.nurse.id == n.id])
-                for n in self.nurses
-            },
+            'total_travel_time': int(arrays['travel'].sum()),
+            'visits_per_nurse': {n.id: count for n, count in zip(self.nurses, per_nurse)},
+            'visits_per_zone': {zone: count for zone, count in zip(Config.ZONE_ID, per_zone) if count},
             'unassigned_visits': len(self.unassigned_visits)
         }
 
 
+# ============================================================
+# SCHEDULER (OR-Tools VRP with time windows)
+# ============================================================
+
+class VRPScheduler(SimpleScheduler):
+    """
+    Vehicle routing scheduler using Google OR-Tools.
+    
+    Nurses are vehicles starting from the hospital, visits are stops with
+    [earliest_time, latest_time] start windows, and the AM/PM visit limits
+    are per-nurse capacities. Continuity groups are forced onto one nurse.
+    The greedy SimpleScheduler result is the warm start, and is kept if
+    OR-Tools cannot improve on it within the time limit.
+    
+    Guided local search always runs to its time limit, so OR-Tools is only
+    called when the greedy result leaves a visit unassigned in a session
+    that still has spare nurse capacity, and the limit grows with the roster.
+    """
+    
+    MIN_VISITS = 12            # Smaller rosters are left to the greedy scheduler
+    TIME_LIMIT_SECONDS = 5     # Search time for the largest rosters
+    VISITS_PER_SECOND = 50     # Search time is one second per this many visits
+    UNASSIGNED_PENALTY = 100000  # Cost of leaving a visit unscheduled
+    
+    def solve(self) -> bool:
+        """Solve greedily, then improve the routes with OR-Tools if it can help."""
+        super().solve()
+        if not self._has_spare_capacity():
+            return len(self.scheduled_visits) > 0
+        
+        greedy_cost = (len(self.unassigned_visits), self._total_travel(self.scheduled_visits))
+        try:
+            result = self._solve_routing()
+        except Exception:
+            # OR-Tools rejects models it cannot build (it raises a bare
+            # Exception); the greedy schedule stands
+            result = None
+        if result is not None:
+            scheduled, unassigned = result
+            if (len(unassigned), self._total_travel(scheduled)) < greedy_cost:
+                self.scheduled_visits = scheduled
+                self.unassigned_visits = unassigned
+                self._cg_to_nurse = {
+                    sv.visit.continuity_group: sv.nurse.id
+                    for sv in scheduled if sv.visit.continuity_group
+                }
+        
+        return len(self.scheduled_visits) > 0
+    
+    def _has_spare_capacity(self) -> bool:
+        """Whether any unassigned visit's session has a nurse with room left."""
+        load = defaultdict(int)
+        for sv in self.scheduled_visits:
+            load[(sv.nurse.id, sv.visit.session)] += 1
+        sessions = {v.session for v in self.unassigned_visits}
+        return any(
+            load[(n.id, session)] < (n.max_visits_am if session == "AM" else n.max_visits_pm)
+            for session in sessions for n in self.nurses
+        )
+    
+    @staticmethod
+    def _total_travel(scheduled_visits: List[ScheduledVisit]) -> int:
+        return sum(sv.travel_time_from_previous for sv in scheduled_visits)
+    
+    def _solve_routing(self) -> Optional[Tuple[List[ScheduledVisit], List[Visit]]]:
+        """Build and solve the routing model; None if no solution is found."""
+        num_visits = len(self.visits)
+        num_nurses = len(self.nurses)
+        
+        # Node 0 is the hospital, node i + 1 is visit i
+        zones = np.concatenate(([Config.ZONE_ID["Central"]], self.zone_id)).astype(np.intp)
+        sessions = np.concatenate(([-1], self.session_id))
+        service = np.concatenate(([0], self.duration)).astype(int)
+        travel = Config.TRAVEL[np.ix_(zones, zones)].astype(int)
+        
+        # Cost counts travel the same way as the greedy scheduler reports it:
+        # the first visit of each session is reached from the hospital
+        cost = np.where(sessions[:, None] != sessions[None, :], Config.HOSPITAL_RETURN_TIME, travel)
+        cost[:, 0] = 0
+        # Time follows the nurse's actual day: service, then drive to the next stop
+        transit = service[:, None] + travel
+        transit[0, :] = 0  # Nurses start at 8:30 at their first patient
+        cost, transit = cost.tolist(), transit.tolist()
+        
+        manager = pywrapcp.RoutingIndexManager(num_visits + 1, num_nurses, 0)
+        routing = pywrapcp.RoutingModel(manager)
+        
+        def cost_callback(from_index, to_index):
+            return cost[manager.IndexToNode(from_index)][manager.IndexToNode(to_index)]
+        
+        def time_callback(from_index, to_index):
+            return transit[manager.IndexToNode(from_index)][manager.IndexToNode(to_index)]
+        
+        routing.SetArcCostEvaluatorOfAllVehicles(routing.RegisterTransitCallback(cost_callback))
+        
+        # Tasks may name late times ("Others 24:30"), so the day can run past
+        # midnight; leave room to finish the last visit and drive back
+        horizon = max(24 * 60, int(self.latest.max(initial=0)) + int(self.duration.max(initial=0))
+                      + int(travel.max()))
+        routing.AddDimension(routing.RegisterTransitCallback(time_callback),
+                             horizon, horizon, False, "Time")
+        time_dimension = routing.GetDimensionOrDie("Time")
+        for v in range(num_nurses):
+            time_dimension.CumulVar(routing.Start(v)).SetRange(Config.WORK_START, horizon)
+        for i in range(num_visits):
+            index = manager.NodeToIndex(i + 1)
+            time_dimension.CumulVar(index).SetRange(int(self.earliest[i]), int(self.latest[i]))
+            routing.AddDisjunction([index], self.UNASSIGNED_PENALTY)
+        
+        # Session capacity: one unit per visit in that session
+        for session, name in enumerate(self.SESSIONS):
+            demand = [int(s == session) for s in sessions.tolist()]
+            demand_callback = routing.RegisterUnaryTransitCallback(
+                lambda index, demand=demand: demand[manager.IndexToNode(index)])
+            capacities = [n.max_visits_am if session == 0 else n.max_visits_pm for n in self.nurses]
+            routing.AddDimensionWithVehicleCapacity(demand_callback, 0, capacities, True, f"{name}Visits")
+        
+        # Continuity: every visit of a group rides with the same nurse
+        groups = defaultdict(list)
+        for i, visit in enumerate(self.visits):
+            if visit.continuity_group:
+                groups[visit.continuity_group].append(manager.NodeToIndex(i + 1))
+        for members in groups.values():
+            for other in members[1:]:
+                routing.solver().Add(routing.VehicleVar(members[0]) == routing.VehicleVar(other))
+        
+        params = pywrapcp.DefaultRoutingSearchParameters()
+        params.first_solution_strategy = (
+            routing_enums_pb2.FirstSolutionStrategy.PARALLEL_CHEAPEST_INSERTION)
+        params.local_search_metaheuristic = (
+            routing_enums_pb2.LocalSearchMetaheuristic.GUIDED_LOCAL_SEARCH)
+        params.time_limit.FromSeconds(
+            max(1, min(self.TIME_LIMIT_SECONDS, num_visits // self.VISITS_PER_SECOND)))
+        routing.CloseModelWithParameters(params)
+        
+        # Warm start from the greedy schedule when it fits the model
+        visit_node = {id(v): i + 1 for i, v in enumerate(self.visits)}
+        by_nurse = self.get_schedule_by_nurse()
+        warm_routes = [[visit_node[id(sv.visit)] for sv in by_nurse[n.id]] for n in self.nurses]
+        initial = routing.ReadAssignmentFromRoutes(warm_routes, True)
+        if initial is not None:
+            solution = routing.SolveFromAssignmentWithParameters(initial, params)
+        else:
+            solution = routing.SolveWithParameters(params)
+        if solution is None:
+            return None
+        
+        scheduled = []
+        served = set()
+        for v, nurse in enumerate(self.nurses):
+            sequence = {}
+            previous = None
+            index = solution.Value(routing.NextVar(routing.Start(v)))
+            while not routing.IsEnd(index):
+                i = manager.IndexToNode(index) - 1
+                visit = self.visits[i]
+                session = int(self.session_id[i])
+                served.add(i)
+                scheduled.append(ScheduledVisit(
+                    visit=visit,
+                    nurse=nurse,
+                    scheduled_time=solution.Min(time_dimension.CumulVar(index)),
+                    travel_time_from_previous=cost[previous + 1 if previous is not None else 0][i + 1],
+                    sequence=sequence.setdefault(session, 0)
+                ))
+                sequence[session] += 1
+                previous = i
+                index = solution.Value(routing.NextVar(index))
+        
+        unassigned = [v for i, v in enumerate(self.visits) if i not in served]
+        return scheduled, unassigned
+
+
+def make_scheduler(nurses: List[Nurse], visits: List[Visit]) -> SimpleScheduler:
+    """Pick the OR-Tools scheduler for larger rosters, greedy otherwise."""
+    if len(visits) >= VRPScheduler.MIN_VISITS:
+        return VRPScheduler(nurses=nurses, visits=visits)
+    return SimpleScheduler(nurses=nurses, visits=visits)
+
+
+# ============================================================
+# SAMPLE DATA
+# ============================================================
+
+SAMPLE_DATA = {
+    "Name": ["Tan AH", "Lim BK", "Wong CL", "Chen DM", "Lee EF", "Ng GH"],
+    "Location": [
+        "Blk 123 Ang Mo Kio Ave 4 S(560123)",
+        "Blk 456 Toa Payoh Lor 1 S(310456)",
+        "Blk 789 Hougang Ave 5 S(530789)",
+        "Blk 234 Bishan St 22 S(570234)",
+        "Blk 567 Woodlands Dr 14 S(730567)",
+        "Blk 890 Ang Mo Kio Ave 10 S(560890)"
+    ],
+    "Home Visit task/time": ["IV ABx 8 hrly", "Blood taking", "IV ABx", "Wound dressing", "Others (Priority) 10:00", "IV ABx"],
+    "Session 2 task/time": ["IV ABx 8 hrly (PM)", "", "", "", "", ""],
+    "Priority": ["Normal", "Normal", "Normal", "Normal", "Priority", "Normal"],
+    "Language": ["Mandarin", "English", "English", "Mandarin", "Malay", "English"]
+}
+
+
+# ============================================================
+# CACHED PIPELINE
+# ============================================================
+# Streamlit reruns the whole script on every widget interaction; these
+# wrappers let reruns with unchanged inputs skip parsing and solving.
+
+@st.cache_data(show_spinner=False)
+def get_sample_df() -> pd.DataFrame:
+    """The built-in demo roster as a DataFrame."""
+    return pd.DataFrame(SAMPLE_DATA)
+
+
+@st.cache_data(show_spinner=False)
+def parse_roster(df: pd.DataFrame) -> Tuple[List[Patient], List[Visit], List[str]]:
+    """Parse a roster DataFrame into patients, visits and parser warnings."""
+    parser = ExcelParser()
+    patients, visits = parser.parse_dataframe(df)
+    return patients, visits, parser.warnings
+
+
+@st.cache_data(show_spinner=False)
+def load_and_parse(file_bytes: bytes) -> Tuple[pd.DataFrame, List[Patient], List[Visit], List[str]]:
+    """Read and parse an uploaded roster; keyed on the file's bytes."""
+    try:
+        workbook = pd.ExcelFile(io.BytesIO(file_bytes), engine="calamine")
+    except ImportError:
+        # python-calamine missing; openpyxl is slower and reads .xlsx only
+        workbook = pd.ExcelFile(io.BytesIO(file_bytes), engine="openpyxl")
+    with workbook:
+        df = workbook.parse(workbook.sheet_names[0])
+    patients, visits, warnings = parse_roster(df)
+    return df, patients, visits, warnings
+
+
+@st.cache_resource(show_spinner=False)
+def make_nurse(nurse_id: str, name: str, languages: Tuple[str, ...]) -> Nurse:
+    """One shared Nurse per sidebar setting, so reruns reuse the same objects."""
+    return Nurse(id=nurse_id, name=name, languages=list(languages))
+
+
+def scheduler_key(nurses: List[Nurse], visits: List[Visit]) -> Tuple[tuple, tuple]:
+    """
+    Every field of the nurses and visits (patients included).
+    
+    The solved scheduler hands back its own Visit objects for display, so
+    the key must cover what is shown (names, addresses), not just what the
+    solver reads; otherwise another roster with the same layout would get
+    this roster's patients back.
+    """
+    return tuple(astuple(n) for n in nurses), tuple(astuple(v) for v in visits)
+
+
+@st.cache_resource(show_spinner=False, max_entries=16)
+def build_scheduler(nurses_key: tuple, visits_key: tuple,
+                    _nurses: List[Nurse], _visits: List[Visit]) -> SimpleScheduler:
+    """
+    Solve a schedule once per distinct input.
+    
+    Only the keys are hashed; the underscored lists are what the solver
+    actually uses. The solved scheduler is shared across reruns and
+    sessions, so callers must treat it as read-only.
+    """
+    scheduler = make_scheduler(nurses=list(_nurses), visits=list(_visits))
+    scheduler.solve()
+    return scheduler
+
+
+# FastMarkerCluster row callback: row is [lat, lng, popup_html, marker_color]
+_NURSE_MARKER_JS = """
+function (row) {
+    var icon = L.AwesomeMarkers.icon({icon: 'user', prefix: 'fa', markerColor: row[3]});
+    return L.marker(new L.LatLng(row[0], row[1]), {icon: icon})
+        .bindPopup(row[2], {maxWidth: 200});
+}"""
+
+# Marker popup HTML, filled per visit
+_POPUP_TEMPLATE = "<b>{patient}</b><br>Time: {time}<br>Procedure: {procedure}<br>Nurse: {nurse}"
+
+
+def map_key(schedule: Dict[str, List[ScheduledVisit]], nurses: List[Nurse]) -> tuple:
+    """Hashable summary of everything drawn on the route map."""
+    return tuple(
+        (nurse.id, nurse.name, tuple(
+            (sv.visit.patient.id, sv.visit.patient.name, sv.visit.patient.zone,
+             sv.visit.procedure, sv.scheduled_time)
+            for sv in schedule[nurse.id]
+        ))
+        for nurse in nurses
+    )
+
+
+@st.cache_data(show_spinner=False)
+def build_map_html(schedule_key: tuple, _schedule: Dict[str, List[ScheduledVisit]],
+                   _nurses: List[Nurse]) -> str:
+    """Render the route map to standalone HTML; keyed on map_key()."""
+    # Create map centered on TTSH
+    m = folium.Map(
+        location=[Config.HOSPITAL_LAT, Config.HOSPITAL_LNG],
+        zoom_start=12,
+        tiles='CartoDB positron'
+    )
+    
+    # Add hospital marker
+    folium.Marker(
+        [Config.HOSPITAL_LAT, Config.HOSPITAL_LNG],
+        popup='🏥 TTSH (Start/End)',
+        icon=folium.Icon(color='red', icon='plus', prefix='fa')
+    ).add_to(m)
+    
+    # Fixed per-patient offset within the zone, so a patient's markers stay
+    # put across reruns and server restarts
+    patient_ids = sorted({sv.visit.patient.id for visits in _schedule.values() for sv in visits})
+    offsets = np.random.default_rng(0).uniform(-0.02, 0.02, (len(patient_ids), 2)).tolist()
+    jitter = dict(zip(patient_ids, offsets))
+    
+    for nurse, color in zip(_nurses, cycle(Config.NURSE_COLORS)):
+        nurse_visits = _schedule[nurse.id]
+        
+        if not nurse_visits:
+            continue
+        
+        # One toggleable layer per nurse; markers are drawn client-side
+        layer = folium.FeatureGroup(name=nurse.name)
+        route_coords = [[Config.HOSPITAL_LAT, Config.HOSPITAL_LNG]]
+        markers = []
+        nurse_name = html.escape(nurse.name)  # Names are free text; popups are HTML
+        popups = [
+            _POPUP_TEMPLATE.format(
+                patient=html.escape(sv.visit.patient.name),
+                time=TIME_STR[sv.scheduled_time],
+                procedure=html.escape(sv.visit.procedure),
+                nurse=nurse_name
+            )
+            for sv in nurse_visits
+        ]
+        
+        for sv, popup_text in zip(nurse_visits, popups):
+            # Use approximate coordinates based on zone
+            lat, lng = Config.ZONE_COORDS.get(sv.visit.patient.zone, Config.ZONE_COORDS["Central"])
+            dlat, dlng = jitter[sv.visit.patient.id]
+            lat += dlat
+            lng += dlng
+            
+            route_coords.append([lat, lng])
+            markers.append([lat, lng, popup_text, color])
+        
+        FastMarkerCluster(
+            markers,
+            callback=_NURSE_MARKER_JS,
+            control=False,
+            disableClusteringAtZoom=14
+        ).add_to(layer)
+        
+        route_coords.append([Config.HOSPITAL_LAT, Config.HOSPITAL_LNG])
+        
+        folium.PolyLine(
+            route_coords,
+            weight=3,
+            color=color,
+            opacity=0.7,
+            popup=f"{nurse_name}'s Route"
+        ).add_to(layer)
+        
+        layer.add_to(m)
+    
+    folium.LayerControl(collapsed=False).add_to(m)
+    
+    return m.get_root().render()
+
+
+# Figures are cached as plotly JSON; render with pio.from_json
+
+@st.cache_data(show_spinner=False)
+def visits_per_nurse_figure(names: Tuple[str, ...], counts: Tuple[int, ...]) -> str:
+    """Bar chart of visits per nurse."""
+    fig = px.bar(
+        x=list(names),
+        y=list(counts),
+        title="Visits per Nurse",
+        labels={'x': 'Nurse', 'y': 'Number of Visits'}
+    )
+    return fig.to_json()
+
+
+@st.cache_data(show_spinner=False)
+def zone_figure(zones: Tuple[str, ...], counts: Tuple[int, ...]) -> str:
+    """Pie chart of visits by zone."""
+    fig = px.pie(
+        values=list(counts),
+        names=list(zones),
+        title="Visits by Zone"
+    )
+    return fig.to_json()
+
+
+@st.cache_data(show_spinner=False)
+def timeline_figure(timeline_df: pd.DataFrame) -> str:
+    """Gantt chart of visits with Nurse, Patient, Start and End columns."""
+    fig = px.timeline(
+        timeline_df,
+        x_start='Start',
+        x_end='End',
+        y='Nurse',
+        color='Nurse',
+        hover_name='Patient',
+        title="Gantt Chart View"
+    )
+    fig.update_layout(xaxis_title="Time")
+    return fig.to_json()
+
+
 # ============================================================
 # STREAMLIT UI
 # ============================================================
 
+def render_map(scheduler: SimpleScheduler):
+    """Route map and legend for a solved schedule."""
+    schedule = scheduler.get_schedule_by_nurse()
+    nurses_shown = scheduler.nurses
+    components.html(
+        build_map_html(map_key(schedule, nurses_shown), schedule, nurses_shown),
+        width=800, height=500
+    )
+    
+    # Legend, in one element; marker colors are also valid CSS colors
+    items = "".join(
+        f"<li><span style='color:{color}'>●</span> <b>{html.escape(nurse.name)}</b></li>"
+        for nurse, color in zip(nurses_shown, cycle(Config.NURSE_COLORS))
+    )
+    st.markdown(f"<b>Legend:</b><ul>{items}</ul>", unsafe_allow_html=True)
+
+
+def render_analytics(scheduler: SimpleScheduler):
+    """Charts and timeline for a solved schedule."""
+    arrays = scheduler.scheduled_arrays()
+    metrics = scheduler.calculate_metrics(arrays)
+    
+    col1, col2 = st.columns(2)
+    
+    with col1:
+        # Visits per nurse chart
+        # Bars are labelled by name; a repeated name gets its nurse id
+        # so the bars don't merge
+        name_counts = Counter(n.name for n in scheduler.nurses)
+        fig = visits_per_nurse_figure(
+            tuple(n.name if name_counts[n.name] == 1 else f"{n.name} ({n.id})"
+                  for n in scheduler.nurses),
+            tuple(metrics['visits_per_nurse'][n.id] for n in scheduler.nurses)
+        )
+        st.plotly_chart(pio.from_json(fig), use_container_width=True)
+    
+    with col2:
+        # Zone distribution
+        zone_counts = metrics['visits_per_zone']
+        
+        fig = zone_figure(tuple(zone_counts.keys()), tuple(zone_counts.values()))
+        st.plotly_chart(pio.from_json(fig), use_container_width=True)
+    
+    # Timeline visualization
+    st.subheader("📅 Schedule Timeline")
+    
+    scheduled = scheduler.scheduled_visits
+    if scheduled:
+        starts = arrays['start']
+        ends = starts + arrays['duration']
+        day = pd.Timestamp(2024, 1, 1)
+        timeline_df = pd.DataFrame({
+            'Nurse': np.array([n.name for n in scheduler.nurses], dtype=object)[arrays['nurse']],
+            'Patient': [sv.visit.patient.name for sv in scheduled],
+            'Start': day + pd.to_timedelta(starts, unit='m'),
+            'End': day + pd.to_timedelta(ends, unit='m')
+        })
+        
+        st.plotly_chart(pio.from_json(timeline_figure(timeline_df)), use_container_width=True)
+
+
 def main():
     """Main Streamlit application."""
     
@@ -498,11 +1178,7 @@ def main():
                 default=["English"],
                 key=f"nurse_lang_{i}"
             )
-            nurses.append(Nurse(
-                id=f"N{i:03d}",
-                name=name,
-                languages=languages
-            ))
+            nurses.append(make_nurse(f"N{i:03d}", name, tuple(sorted(languages))))
     
     # Main content
     tab1, tab2, tab3 = st.tabs(["📤 Upload & Schedule", "🗺️ Route Map", "📊 Analytics"])
@@ -523,12 +1199,13 @@ def main():
         
         if uploaded_file is not None:
             try:
-                df = pd.read_excel(uploaded_file)
+                df, patients, visits, parse_warnings = load_and_parse(uploaded_file.getvalue())
                 data_source = 'upload'
             except Exception as e:
                 st.error(f"Error reading file: {str(e)}")
-        elif 'sample_df' in st.session_state:
-            df = st.session_state['sample_df']
+        elif st.session_state.get('use_sample_data', False):
+            df = get_sample_df()
+            patients, visits, parse_warnings = parse_roster(df)
             data_source = 'sample'
         
         # If we have data, process it
@@ -542,29 +1219,24 @@ def main():
                 with st.expander("📋 Preview Data"):
                     st.dataframe(df)
                 
-                # Parse data
-                parser = ExcelParser()
-                patients, visits = parser.parse_dataframe(df)
-                
                 st.info(f"📊 Parsed: {len(patients)} patients, {len(visits)} visits")
                 
-                if parser.warnings:
+                if parse_warnings:
                     with st.expander("⚠️ Parsing Warnings"):
-                        for w in parser.warnings:
+                        for w in parse_warnings:
                             st.warning(w)
                 
                 # Run scheduler
                 if st.button("🚀 Generate Schedule", type="primary"):
                     with st.spinner("Optimizing routes..."):
-                        scheduler = SimpleScheduler(nurses=nurses, visits=visits)
-                        success = scheduler.solve()
+                        scheduler = build_scheduler(*scheduler_key(nurses, visits), nurses, visits)
+                        success = len(scheduler.scheduled_visits) > 0
                         
                         if success:
                             # Store in session state
                             st.session_state['scheduler'] = scheduler
                             st.session_state['patients'] = patients
                             st.session_state['visits'] = visits
-                            st.session_state['nurses'] = nurses
                             st.session_state['schedule_generated'] = True
                             st.rerun()  # Rerun to display results
                         else:
@@ -575,7 +1247,7 @@ def main():
                     st.success("✅ Schedule generated successfully!")
                     
                     scheduler = st.session_state['scheduler']
-                    stored_nurses = st.session_state['nurses']
+                    stored_nurses = scheduler.nurses
                     
                     # Show results
                     metrics = scheduler.calculate_metrics()
@@ -597,52 +1269,58 @@ def main():
                         st.markdown(f"### 👩‍⚕️ {nurse.name} ({len(nurse_visits)} visits)")
                         
                         if nurse_visits:
-                            schedule_data = []
-                            for sv in nurse_visits:
-                                schedule_data.append({
-                                    "Seq": sv.sequence + 1,
-                                    "Time": minutes_to_time_string(sv.scheduled_time),
-                                    "Patient": sv.visit.patient.name,
-                                    "Procedure": sv.visit.procedure,
-                                    "Zone": sv.visit.patient.zone,
-                                    "Travel (min)": sv.travel_time_from_previous
-                                })
-                            st.dataframe(pd.DataFrame(schedule_data), use_container_width=True)
+                            schedule_data = pd.DataFrame({
+                                "Seq": [sv.sequence + 1 for sv in nurse_visits],
+                                "Time": [TIME_STR[sv.scheduled_time] for sv in nurse_visits],
+                                "Patient": [sv.visit.patient.name for sv in nurse_visits],
+                                "Procedure": [sv.visit.procedure for sv in nurse_visits],
+                                "Zone": [sv.visit.patient.zone for sv in nurse_visits],
+                                "Travel (min)": [sv.travel_time_from_previous for sv in nurse_visits]
+                            })
+                            st.dataframe(schedule_data, use_container_width=True)
                         else:
                             st.info("No visits assigned")
                     
                     # Export button
                     st.subheader("📥 Export Schedule")
                     
-                    # Create export DataFrame
-                    export_rows = []
-                    for nurse in stored_nurses:
-                        for sv in schedule[nurse.id]:
-                            export_rows.append({
-                                'Nurse': nurse.name,
-                                'Sequence': sv.sequence + 1,
-                                'Scheduled Time': minutes_to_time_string(sv.scheduled_time),
-                                'Patient Name': sv.visit.patient.name,
-                                'Location': sv.visit.patient.address,
-                                'Zone': sv.visit.patient.zone,
-                                'Procedure': sv.visit.procedure,
-                                'Session': sv.visit.session,
-                                'Travel Time (min)': sv.travel_time_from_previous
-                            })
-                    
-                    export_df = pd.DataFrame(export_rows)
+                    # Create export DataFrame, one column at a time
+                    export_visits = [sv for nurse in stored_nurses for sv in schedule[nurse.id]]
+                    export_df = pd.DataFrame({
+                        'Nurse': [sv.nurse.name for sv in export_visits],
+                        'Sequence': [sv.sequence + 1 for sv in export_visits],
+                        'Scheduled Time': [TIME_STR[sv.scheduled_time] for sv in export_visits],
+                        'Patient Name': [sv.visit.patient.name for sv in export_visits],
+                        'Location': [sv.visit.patient.address for sv in export_visits],
+                        'Zone': [sv.visit.patient.zone for sv in export_visits],
+                        'Procedure': [sv.visit.procedure for sv in export_visits],
+                        'Session': [sv.visit.session for sv in export_visits],
+                        'Travel Time (min)': [sv.travel_time_from_previous for sv in export_visits]
+                    })
                     
-                    # Excel download
-                    buffer = io.BytesIO()
-                    with pd.ExcelWriter(buffer, engine='openpyxl') as writer:
-                        export_df.to_excel(writer, index=False, sheet_name='Schedule')
+                    export_format = st.radio("Format", ["Excel", "CSV"], horizontal=True)
+                    stamp = datetime.now().strftime('%Y%m%d_%H%M')
                     
-                    st.download_button(
-                        label="📥 Download Schedule (Excel)",
-                        data=buffer.getvalue(),
-                        file_name=f"schedule_{datetime.now().strftime('%Y%m%d_%H%M')}.xlsx",
-                        mime="application/vnd.openxmlformats-officedocument.spreadsheetml.sheet"
-                    )
+                    if export_format == "CSV":
+                        st.download_button(
+                            label="📥 Download Schedule (CSV)",
+                            data=export_df.to_csv(index=False).encode("utf-8"),
+                            file_name=f"schedule_{stamp}.csv",
+                            mime="text/csv"
+                        )
+                    else:
+                        # No constant_memory: pandas writes column by column, which
+                        # that mode silently drops for all but the last row
+                        buffer = io.BytesIO()
+                        with pd.ExcelWriter(buffer, engine='xlsxwriter') as writer:
+                            export_df.to_excel(writer, index=False, sheet_name='Schedule')
+                        
+                        st.download_button(
+                            label="📥 Download Schedule (Excel)",
+                            data=buffer.getvalue(),
+                            file_name=f"schedule_{stamp}.xlsx",
+                            mime="application/vnd.openxmlformats-officedocument.spreadsheetml.sheet"
+                        )
             
             except Exception as e:
                 st.error(f"Error processing data: {str(e)}")
@@ -652,24 +1330,7 @@ def main():
             st.info("👆 Upload an Excel file to get started, or use sample data below")
             
             if st.button("📝 Use Sample Data"):
-                # Create sample data
-                sample_data = {
-                    "Name": ["Tan AH", "Lim BK", "Wong CL", "Chen DM", "Lee EF", "Ng GH"],
-                    "Location": [
-                        "Blk 123 Ang Mo Kio Ave 4 S(560123)",
-                        "Blk 456 Toa Payoh Lor 1 S(310456)",
-                        "Blk 789 Hougang Ave 5 S(530789)",
-                        "Blk 234 Bishan St 22 S(570234)",
-                        "Blk 567 Woodlands Dr 14 S(730567)",
-                        "Blk 890 Ang Mo Kio Ave 10 S(560890)"
-                    ],
-                    "Home Visit task/time": ["IV ABx 8 hrly", "Blood taking", "IV ABx", "Wound dressing", "Others (Priority) 10:00", "IV ABx"],
-                    "Session 2 task/time": ["IV ABx 8 hrly (PM)", "", "", "", "", ""],
-                    "Priority": ["Normal", "Normal", "Normal", "Normal", "Priority", "Normal"],
-                    "Language": ["Mandarin", "English", "English", "Mandarin", "Malay", "English"]
-                }
-                sample_df = pd.DataFrame(sample_data)
-                st.session_state['sample_df'] = sample_df
+                st.session_state['use_sample_data'] = True
                 st.rerun()
     
     # Tab 2: Route Map
@@ -677,87 +1338,7 @@ def main():
         st.header("🗺️ Route Visualization")
         
         if 'scheduler' in st.session_state:
-            scheduler = st.session_state['scheduler']
-            
-            # Create map centered on TTSH
-            m = folium.Map(
-                location=[Config.HOSPITAL_LAT, Config.HOSPITAL_LNG],
-                zoom_start=12,
-                tiles='CartoDB positron'
-            )
-            
-            # Add hospital marker
-            folium.Marker(
-                [Config.HOSPITAL_LAT, Config.HOSPITAL_LNG],
-                popup='🏥 TTSH (Start/End)',
-                icon=folium.Icon(color='red', icon='plus', prefix='fa')
-            ).add_to(m)
-            
-            # Colors for nurses
-            colors = ['blue', 'green', 'purple', 'orange', 'darkred']
-            
-            schedule = scheduler.get_schedule_by_nurse()
-            
-            for idx, nurse in enumerate(st.session_state['nurses']):
-                nurse_visits = schedule[nurse.id]
-                color = colors[idx % len(colors)]
-                
-                if not nurse_visits:
-                    continue
-                
-                route_coords = [[Config.HOSPITAL_LAT, Config.HOSPITAL_LNG]]
-                
-                for sv_idx, sv in enumerate(nurse_visits):
-                    # Use approximate coordinates based on zone
-                    zone_coords = {
-                        "North": (1.42, 103.82),
-                        "South": (1.27, 103.82),
-                        "East": (1.35, 103.94),
-                        "West": (1.35, 103.70),
-                        "Central": (1.35, 103.85)
-                    }
-                    
-                    lat, lng = zone_coords.get(sv.visit.patient.zone, (1.35, 103.85))
-                    # Use DETERMINISTIC offset based on patient name hash (not random!)
-                    # This prevents infinite reruns from changing coordinates
-                    name_hash = hash(sv.visit.patient.name + str(sv_idx))
-                    lat += ((name_hash % 1000) / 1000 - 0.5) * 0.04
-                    lng += (((name_hash // 1000) % 1000) / 1000 - 0.5) * 0.04
-                    
-                    route_coords.append([lat, lng])
-                    
-                    time_str = minutes_to_time_string(sv.scheduled_time)
-                    popup_text = f"""
-                        <b>{sv.visit.patient.name}</b><br>
-                        Time: {time_str}<br>
-                        Procedure: {sv.visit.procedure}<br>
-                        Nurse: {nurse.name}
-                    """
-                    
-                    folium.Marker(
-                        [lat, lng],
-                        popup=folium.Popup(popup_text, max_width=200),
-                        icon=folium.Icon(color=color, icon='user', prefix='fa')
-                    ).add_to(m)
-                
-                route_coords.append([Config.HOSPITAL_LAT, Config.HOSPITAL_LNG])
-                
-                folium.PolyLine(
-                    route_coords,
-                    weight=3,
-                    color=color,
-                    opacity=0.7,
-                    popup=f"{nurse.name}'s Route"
-                ).add_to(m)
-            
-            # CRITICAL: returned_objects=[] prevents infinite rerun loops!
-            st_folium(m, width=800, height=500, returned_objects=[])
-            
-            # Legend
-            st.markdown("**Legend:**")
-            for idx, nurse in enumerate(st.session_state['nurses']):
-                color = colors[idx % len(colors)]
-                st.markdown(f"- 🔵 **{nurse.name}**" if color == 'blue' else f"- ⚫ **{nurse.name}**")
+            render_map(st.session_state['scheduler'])
         
         else:
             st.info("👆 Generate a schedule first to see the route map")
@@ -767,62 +1348,7 @@ def main():
         st.header("📊 Schedule Analytics")
         
         if 'scheduler' in st.session_state:
-            scheduler = st.session_state['scheduler']
-            metrics = scheduler.calculate_metrics()
-            
-            col1, col2 = st.columns(2)
-            
-            with col1:
-                # Visits per nurse chart
-                fig = px.bar(
-                    x=list(metrics['visits_per_nurse'].keys()),
-                    y=list(metrics['visits_per_nurse'].values()),
-                    title="Visits per Nurse",
-                    labels={'x': 'Nurse', 'y': 'Number of Visits'}
-                )
-                st.plotly_chart(fig, use_container_width=True)
-            
-            with col2:
-                # Zone distribution
-                zone_counts = {}
-                for sv in scheduler.scheduled_visits:
-                    zone = sv.visit.patient.zone
-                    zone_counts[zone] = zone_counts.get(zone, 0) + 1
-                
-                fig = px.pie(
-                    values=list(zone_counts.values()),
-                    names=list(zone_counts.keys()),
-                    title="Visits by Zone"
-                )
-                st.plotly_chart(fig, use_container_width=True)
-            
-            # Timeline visualization
-            st.subheader("📅 Schedule Timeline")
-            
-            timeline_data = []
-            for sv in scheduler.scheduled_visits:
-                timeline_data.append({
-                    'Nurse': sv.nurse.name,
-                    'Patient': sv.visit.patient.name,
-                    'Start': datetime(2024, 1, 1, sv.scheduled_time // 60, sv.scheduled_time % 60),
-                    'End': datetime(2024, 1, 1, (sv.scheduled_time + sv.visit.duration_minutes) // 60, 
-                                   (sv.scheduled_time + sv.visit.duration_minutes) % 60)
-                })
-            
-            if timeline_data:
-                timeline_df = pd.DataFrame(timeline_data)
-                
-                fig = px.timeline(
-                    timeline_df,
-                    x_start='Start',
-                    x_end='End',
-                    y='Nurse',
-                    color='Nurse',
-                    hover_name='Patient',
-                    title="Gantt Chart View"
-                )
-                fig.update_layout(xaxis_title="Time")
-                st.plotly_chart(fig, use_container_width=True)
+            render_analytics(st.session_state['scheduler'])
         
         else:
             st.info("👆 Generate a schedule first to see analytics")